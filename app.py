@@ -1,16 +1,35 @@
 import streamlit as st
-import pytesseract
-from pytesseract import Output
+try:
+    from tesserocr import PyTessBaseAPI, PSM, RIL
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    import pytesseract
+    from pytesseract import Output
+    TESSEROCR_AVAILABLE = False
+try:
+    from paddleocr import PaddleOCR
+    PADDLEOCR_AVAILABLE = True
+except ImportError:
+    PADDLEOCR_AVAILABLE = False
 from PIL import Image
 import cv2
 import numpy as np
 import json
+import orjson
 import hashlib
-import requests
+import httpx
+import asyncio
 import io
 import os
 from typing import List, Dict, Any
 from dotenv import load_dotenv
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+    wait_random,
+)
 
 # Load environment variables
 load_dotenv()
@@ -18,7 +37,6 @@ load_dotenv()
 st.title("🧾 Form Schema Extractor (PyTesseract + Vision LLM API)")
 
 # --- Environment-based API settings ---
-@st.cache_data
 def load_api_config():
     """Load API configuration from environment variables"""
     return {
@@ -26,10 +44,13 @@ def load_api_config():
         "auth_token": os.getenv("VISION_LLM_AUTH_TOKEN", ""),
         "api_key": os.getenv("VISION_LLM_API_KEY", ""),
         "timeout": int(os.getenv("API_TIMEOUT", "30")),
-        "max_retries": int(os.getenv("API_MAX_RETRIES", "3"))
+        "max_retries": int(os.getenv("API_MAX_RETRIES", "3")),
+        # Clamp to >=1: 0 would make the batch semaphore hang forever
+        "max_concurrency": max(1, int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "5")))
     }
 
-# Load configuration
+# Load configuration once at import — a dict of env-derived primitives
+# doesn't need st.cache_data's lookup/hashing machinery
 config = load_api_config()
 
 # Display current configuration (with masked sensitive data)
@@ -51,89 +72,275 @@ else:
     vision_llm_auth_token = config['auth_token']
     vision_llm_api_key = config['api_key']
 
-uploaded_file = st.file_uploader("📤 Upload a blank form image", type=["png", "jpg", "jpeg"])
+# Concurrency control for batch processing (cap comes from the environment
+# so deployments can tune it)
+with st.sidebar:
+    st.markdown("### ⚙️ Performance")
+    if config['max_concurrency'] > 1:
+        max_concurrent_calls = st.slider(
+            "Max concurrent LLM calls",
+            1,
+            config['max_concurrency'],
+            min(5, config['max_concurrency'])
+        )
+    else:
+        # st.slider rejects min_value == max_value, so don't offer a choice
+        max_concurrent_calls = 1
+        st.caption("Max concurrent LLM calls: 1 (raise MAX_CONCURRENT_LLM_CALLS to enable more)")
 
-def preprocess_image(image: Image.Image) -> np.ndarray:
-    """Preprocess image for better OCR results"""
-    img_np = np.array(image)
-    gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-    
-    # Apply denoising
-    denoised = cv2.fastNlMeansDenoising(gray)
-    
-    # Apply adaptive threshold for better text detection
+uploaded_files = st.file_uploader(
+    "📤 Upload blank form image(s)",
+    type=["png", "jpg", "jpeg"],
+    accept_multiple_files=True
+)
+
+@st.cache_data(show_spinner=False)
+def preprocess_image(form_hash: str, _gray: np.ndarray, use_preprocessing: bool = True) -> np.ndarray:
+    """Preprocess a grayscale image for better OCR results (cached by form content hash)"""
+    if not use_preprocessing:
+        _, thresh = cv2.threshold(_gray, 150, 255, cv2.THRESH_BINARY_INV)
+        return thresh
+
+    # Apply denoising (edge-preserving bilateral filter; far cheaper than
+    # non-local means and a single pass over the buffer)
+    denoised = cv2.bilateralFilter(_gray, 5, 75, 75)
+
+    # Apply adaptive threshold for better text detection, scaling the
+    # neighbourhood with resolution — a fixed 11px block undersamples
+    # high-resolution scans and loses stroke edges (blockSize must be odd)
+    height, width = _gray.shape
+    block_size = max(11, int(min(height, width) / 100) | 1)
     thresh = cv2.adaptiveThreshold(
-        denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2
+        denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, 2
     )
-    
+
     return thresh
 
-def extract_ocr_data(image: np.ndarray, confidence_threshold: int = 60) -> List[Dict[str, Any]]:
-    """Extract OCR data with improved filtering"""
-    try:
-        ocr_data = pytesseract.image_to_data(image, output_type=Output.DICT)
-    except Exception as e:
-        st.error(f"OCR processing failed: {e}")
-        return []
-    
-    n_boxes = len(ocr_data['text'])
+# Minimum recognition score accepted from PaddleOCR before the user threshold applies
+PADDLE_MIN_SCORE = 0.6
+
+# Confidence → annotation color lookup (BGR): red up to 70, orange 71-80,
+# green above — a branchless replacement for per-box ternaries
+COLOR_LUT = np.zeros((101, 3), np.uint8)
+COLOR_LUT[:71] = (0, 0, 255)
+COLOR_LUT[71:81] = (0, 165, 255)
+COLOR_LUT[81:] = (0, 255, 0)
+
+# WebP roughly halves bytes-on-the-wire vs JPEG at OCR-level quality;
+# set UPLOAD_FORMAT=jpeg if the remote API rejects image/webp
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "webp").lower()
+
+def encode_upload_image(bgr: np.ndarray) -> tuple:
+    """Encode the API upload payload; returns (buffer, filename, mime type)"""
+    if UPLOAD_FORMAT == "webp":
+        ok, encoded = cv2.imencode('.webp', bgr, [cv2.IMWRITE_WEBP_QUALITY, 85])
+        if ok:
+            return io.BytesIO(encoded.tobytes()), "form.webp", "image/webp"
+    _, encoded = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return io.BytesIO(encoded.tobytes()), "form.jpg", "image/jpeg"
+
+@st.cache_resource
+def get_paddle_ocr():
+    """Keep a single PaddleOCR detector/recognizer resident across reruns"""
+    use_gpu = os.getenv("PADDLE_USE_GPU", "true").lower() in ("1", "true", "yes")
+    return PaddleOCR(use_angle_cls=True, lang='en', use_gpu=use_gpu)
+
+def _extract_with_paddleocr(image: np.ndarray, confidence_threshold: int) -> List[Dict[str, Any]]:
+    """Extract OCR data using PaddleOCR (handles detection/rectification internally)"""
+    ocr = get_paddle_ocr()
+    raw = ocr.ocr(image, cls=True)
+
     results = []
-    
-    for i in range(n_boxes):
-        confidence = int(ocr_data['conf'][i])
-        if confidence > confidence_threshold:
-            text = ocr_data['text'][i].strip()
-            if text and len(text) > 1:  # Filter out single characters
-                x, y, w, h = (
-                    ocr_data['left'][i], 
-                    ocr_data['top'][i], 
-                    ocr_data['width'][i], 
-                    ocr_data['height'][i]
-                )
-                
-                # Skip very small boxes (likely noise)
-                if w > 5 and h > 5:
-                    results.append({
-                        "text": text,
-                        "bbox": [x, y, x + w, y + h],
-                        "confidence": confidence,
-                        "line_num": ocr_data['line_num'][i],
-                        "block_num": ocr_data['block_num'][i],
-                        "page_num": ocr_data['page_num'][i],
-                        "width": w,
-                        "height": h
-                    })
-    
+    line_num = 0
+    for page in raw or []:
+        for quad, (text, score) in page or []:
+            if score <= PADDLE_MIN_SCORE:
+                continue
+
+            text = text.strip()
+            if not text or len(text) <= 1:
+                continue
+
+            # Convert the quadrilateral box to the axis-aligned [x1, y1, x2, y2]
+            # shape the rest of the pipeline consumes
+            xs = [int(point[0]) for point in quad]
+            ys = [int(point[1]) for point in quad]
+            x1, y1, x2, y2 = min(xs), min(ys), max(xs), max(ys)
+            w, h = x2 - x1, y2 - y1
+
+            # Skip very small boxes (likely noise)
+            if w <= 5 or h <= 5:
+                continue
+
+            confidence = int(round(score * 100))
+            if confidence <= confidence_threshold:
+                continue
+
+            line_num += 1
+            results.append({
+                "text": text,
+                "bbox": [x1, y1, x2, y2],
+                "confidence": confidence,
+                "line_num": line_num,
+                "block_num": 1,
+                "page_num": 1,
+                "width": w,
+                "height": h
+            })
+
     return results
 
-def create_annotated_image(original_image: np.ndarray, ocr_results: List[Dict[str, Any]]) -> np.ndarray:
-    """Create image with bounding boxes and confidence scores"""
-    annotated_image = original_image.copy()
-    
+@st.cache_resource
+def get_tesseract_api():
+    """Keep a single in-process Tesseract API instance resident across reruns"""
+    return PyTessBaseAPI(psm=PSM.SPARSE_TEXT)
+
+def _extract_with_tesserocr(image: np.ndarray, confidence_threshold: int) -> List[Dict[str, Any]]:
+    """Extract OCR data using the in-process tesserocr binding (no subprocess)"""
+    api = get_tesseract_api()
+    api.SetImage(Image.fromarray(image))
+
+    results = []
+    for _, box, block_num, par_num in api.GetComponentImages(RIL.WORD, True):
+        x, y, w, h = box['x'], box['y'], box['w'], box['h']
+
+        # Skip very small boxes (likely noise)
+        if w <= 5 or h <= 5:
+            continue
+
+        api.SetRectangle(x, y, w, h)
+        text = api.GetUTF8Text().strip()
+        confidence = api.MeanTextConf()
+
+        if confidence > confidence_threshold and text and len(text) > 1:
+            results.append({
+                "text": text,
+                "bbox": [x, y, x + w, y + h],
+                "confidence": confidence,
+                "line_num": par_num,
+                "block_num": block_num,
+                "page_num": 1,
+                "width": w,
+                "height": h
+            })
+
+    return results
+
+def _extract_with_pytesseract(image: np.ndarray, confidence_threshold: int) -> List[Dict[str, Any]]:
+    """Fallback OCR extraction via the pytesseract subprocess wrapper"""
+    ocr_data = pytesseract.image_to_data(image, output_type=Output.DICT)
+
+    texts = [t.strip() for t in ocr_data['text']]
+    if not texts:
+        return []
+
+    # Vectorized filtering: build one mask over all boxes instead of
+    # per-box Python conditionals (conf may arrive as strings, hence float)
+    conf = np.asarray(ocr_data['conf'], dtype=np.float32).astype(np.int32)
+    left = np.asarray(ocr_data['left'], dtype=np.int32)
+    top = np.asarray(ocr_data['top'], dtype=np.int32)
+    width = np.asarray(ocr_data['width'], dtype=np.int32)
+    height = np.asarray(ocr_data['height'], dtype=np.int32)
+    text_len = np.fromiter(map(len, texts), dtype=np.int32, count=len(texts))
+
+    # Drop low-confidence, tiny (likely noise), and single-character boxes
+    mask = (conf > confidence_threshold) & (width > 5) & (height > 5) & (text_len > 1)
+
+    x2 = left + width
+    y2 = top + height
+
+    return [
+        {
+            "text": texts[i],
+            "bbox": [int(left[i]), int(top[i]), int(x2[i]), int(y2[i])],
+            "confidence": int(conf[i]),
+            "line_num": ocr_data['line_num'][i],
+            "block_num": ocr_data['block_num'][i],
+            "page_num": ocr_data['page_num'][i],
+            "width": int(width[i]),
+            "height": int(height[i])
+        }
+        for i in np.nonzero(mask)[0]
+    ]
+
+@st.cache_data(show_spinner=False)
+def extract_ocr_data(
+    form_hash: str,
+    _image: np.ndarray,
+    confidence_threshold: int = 60,
+    backend: str = "tesseract",
+    use_preprocessing: bool = True
+) -> List[Dict[str, Any]]:
+    """Extract OCR data with improved filtering (cached by form content hash)
+
+    `use_preprocessing` only participates in the cache key: `_image` is not
+    hashed by Streamlit, so the key must capture how it was produced.
+
+    OCR failures propagate to the caller — returning [] here would memoize
+    a transient failure as "no text" for the life of the process.
+    """
+    if backend == "paddleocr":
+        return _extract_with_paddleocr(_image, confidence_threshold)
+    if TESSEROCR_AVAILABLE:
+        return _extract_with_tesserocr(_image, confidence_threshold)
+    return _extract_with_pytesseract(_image, confidence_threshold)
+
+@st.cache_data(show_spinner=False)
+def create_annotated_image(
+    form_hash: str,
+    _original_image: np.ndarray,
+    ocr_results: List[Dict[str, Any]]
+) -> np.ndarray:
+    """Create image with bounding boxes and confidence scores (cached by form content hash)
+
+    Draws on `_original_image` in place — the caller is done with the decoded
+    buffer by the time it annotates, so copying it would only double memory.
+    """
+    annotated_image = _original_image
+
+    # Bucket boxes by confidence band via the color LUT so each color is
+    # drawn with a single polylines call instead of one cv2.rectangle per box
+    buckets = {}
     for result in ocr_results:
-        x1, y1, x2, y2 = result["bbox"]
-        confidence = result["confidence"]
-        
-        # Color based on confidence: green (high) to red (low)
-        color = (0, 255, 0) if confidence > 80 else (255, 165, 0) if confidence > 70 else (255, 0, 0)
-        
-        cv2.rectangle(annotated_image, (x1, y1), (x2, y2), color, 2)
-        
-        # Add confidence score
-        cv2.putText(
-            annotated_image, 
-            f"{confidence}%", 
-            (x1, y1 - 5), 
-            cv2.FONT_HERSHEY_SIMPLEX, 
-            0.5, 
-            color, 
-            1
+        color = tuple(int(c) for c in COLOR_LUT[min(result["confidence"], 100)])
+        buckets.setdefault(color, []).append(result["bbox"])
+
+    for color, boxes in buckets.items():
+        if not boxes:
+            continue
+        pts = np.array(
+            [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes],
+            dtype=np.int32
         )
-    
+        cv2.polylines(annotated_image, pts, True, color, 2)
+
+    # Add confidence scores (illegible on dense forms, so skip them there)
+    if len(ocr_results) <= 200:
+        for result in ocr_results:
+            x1, y1 = result["bbox"][0], result["bbox"][1]
+            confidence = result["confidence"]
+            color = tuple(int(c) for c in COLOR_LUT[min(confidence, 100)])
+            cv2.putText(
+                annotated_image,
+                f"{confidence}%",
+                (x1, y1 - 5),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                color,
+                1
+            )
+
     return annotated_image
 
-def generate_vision_llm_prompt(form_meta: Dict[str, Any], ocr_results: List[Dict[str, Any]]) -> str:
-    """Generate improved prompt for Vision LLM"""
+@st.cache_data(show_spinner=False)
+def generate_vision_llm_prompt(form_hash: str, form_meta: Dict[str, Any], _ocr_results: List[Dict[str, Any]]) -> str:
+    """Generate improved prompt for Vision LLM (cached by form content hash)
+
+    `form_meta` is tiny and carries the settings that shaped `_ocr_results`,
+    so hashing it (plus form_hash) keys the cache without re-hashing the
+    full OCR result list.
+    """
+    ocr_results = _ocr_results
     return f"""
 You are a Vision LLM helping extract structured form schema from OCR data.
 
@@ -154,10 +361,10 @@ Guidelines:
 ✅ Group related fields logically (Personal Info, Address, Emergency Contact, etc.)
 
 Form Metadata:
-{json.dumps(form_meta, indent=2)}
+{orjson.dumps(form_meta, option=orjson.OPT_INDENT_2).decode()}
 
 OCR Results ({len(ocr_results)} items):
-{json.dumps(ocr_results, indent=2)}
+{orjson.dumps(ocr_results, option=orjson.OPT_INDENT_2).decode()}
 
 Return your output as a JSON object with this structure:
 {{
@@ -182,197 +389,379 @@ Return your output as a JSON object with this structure:
 }}
 """
 
-def call_vision_llm_api(
-    api_url: str, 
-    image_bytes: bytes, 
-    prompt: str, 
+class RetryableAPIError(Exception):
+    """Transient API failure (429/5xx) that is worth retrying"""
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class NonRetryableAPIError(Exception):
+    """Deterministic API failure (401/403) where retrying only wastes requests"""
+
+def _parse_retry_after(response: httpx.Response) -> float:
+    """Pick the longest server-advised retry delay from rate-limit headers, if any"""
+    delays = []
+    for header in ("retry-after", "x-ratelimit-reset-tokens"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                delays.append(float(value.rstrip("s")))
+            except ValueError:
+                pass
+    return max(delays) if delays else None
+
+_BACKOFF_WAIT = wait_exponential(multiplier=1, min=2, max=30) + wait_random(0, 1)
+
+def _wait_for_retry_after(retry_state):
+    """Use the server's advised delay when present, else exponential backoff"""
+    advised = getattr(retry_state.outcome.exception(), "retry_after", None)
+    fallback = _BACKOFF_WAIT(retry_state)
+    if advised is None:
+        return fallback
+    st.warning(
+        f"⏳ Rate limited — server advised waiting {advised:.0f}s "
+        f"(backoff would have been {fallback:.1f}s)"
+    )
+    return max(advised, 0.0)
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=_wait_for_retry_after,
+    retry=retry_if_exception_type((httpx.TimeoutException, httpx.ConnectError, RetryableAPIError)),
+    reraise=True,
+)
+async def _post_once(
+    client: httpx.AsyncClient,
+    api_url: str,
+    files: Dict[str, Any],
+    data: Dict[str, str],
+    headers: Dict[str, str]
+) -> httpx.Response:
+    """Single POST attempt; raises RetryableAPIError only on recoverable statuses"""
+    # Rewind the image stream so a retry re-sends the full payload
+    image_file = files["image"][1]
+    if hasattr(image_file, "seek"):
+        image_file.seek(0)
+
+    response = await client.post(api_url, files=files, data=data, headers=headers)
+    status_code = response.status_code
+
+    if status_code == 401:
+        raise NonRetryableAPIError("Authentication failed. Check your API credentials.")
+    if status_code == 403:
+        raise NonRetryableAPIError("Access forbidden. Check your API permissions.")
+    if status_code == 429:
+        raise RetryableAPIError(
+            "Rate limit exceeded. Please try again later.",
+            retry_after=_parse_retry_after(response)
+        )
+    if status_code >= 500:
+        raise RetryableAPIError(f"Server error {status_code}: {response.text}")
+
+    response.raise_for_status()
+    return response
+
+async def call_vision_llm_api(
+    api_url: str,
+    image_file: io.BytesIO,
+    prompt: str,
     auth_token: str = None,
     api_key: str = None,
     timeout: int = 30,
-    max_retries: int = 3
+    max_retries: int = 3,
+    client: httpx.AsyncClient = None,
+    filename: str = "form.jpg",
+    mime_type: str = "image/jpeg"
 ) -> Dict[str, Any]:
-    """Call Vision LLM API with proper error handling and retry logic"""
-    
+    """Call Vision LLM API asynchronously with proper error handling and retry logic
+
+    `image_file` is a file-like object; httpx chunks it onto the wire
+    instead of holding a second full copy of the encoded image in memory.
+    """
+
     # Prepare headers
     headers = {}
     if auth_token:
         headers["Authorization"] = f"Bearer {auth_token}"
     if api_key:
         headers["X-API-Key"] = api_key
-    
+
     # Prepare files and data
-    files = {"image": ("form.jpg", image_bytes, "image/jpeg")}
+    files = {"image": (filename, image_file, mime_type)}
     data = {"prompt": prompt}
-    
-    # Retry logic
-    for attempt in range(max_retries):
-        try:
-            with st.spinner(f"Calling Vision LLM API... (Attempt {attempt + 1}/{max_retries})"):
-                response = requests.post(
-                    api_url, 
-                    files=files, 
-                    data=data, 
-                    headers=headers,
-                    timeout=timeout
-                )
-                response.raise_for_status()
-                
-                # Validate response content type
-                content_type = response.headers.get('content-type', '')
-                if 'application/json' not in content_type:
-                    st.warning(f"⚠️ Unexpected content type: {content_type}")
-                
-                return response.json()
-                
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                st.warning(f"⏱️ Request timed out on attempt {attempt + 1}. Retrying...")
-                continue
-            st.error("❌ Request timed out after all retry attempts.")
-            return None
-            
-        except requests.exceptions.ConnectionError:
-            if attempt < max_retries - 1:
-                st.warning(f"🔌 Connection failed on attempt {attempt + 1}. Retrying...")
-                continue
-            st.error("❌ Could not connect to Vision LLM API after all retry attempts. Check the endpoint URL.")
-            return None
-            
-        except requests.exceptions.HTTPError as e:
-            status_code = response.status_code
-            
-            # Handle specific HTTP error codes
-            if status_code == 401:
-                st.error("❌ Authentication failed. Check your API credentials.")
-            elif status_code == 403:
-                st.error("❌ Access forbidden. Check your API permissions.")
-            elif status_code == 429:
-                if attempt < max_retries - 1:
-                    st.warning(f"⏳ Rate limited on attempt {attempt + 1}. Retrying...")
-                    continue
-                st.error("❌ Rate limit exceeded. Please try again later.")
-            elif status_code >= 500:
-                if attempt < max_retries - 1:
-                    st.warning(f"🔧 Server error on attempt {attempt + 1}. Retrying...")
-                    continue
-                st.error(f"❌ Server error {status_code}: {response.text}")
-            else:
-                st.error(f"❌ HTTP Error {status_code}: {response.text}")
-            return None
-            
-        except json.JSONDecodeError:
-            st.error("❌ Invalid JSON response from API")
-            st.text("Response content:")
-            st.code(response.text[:500])  # Show first 500 chars of response
-            return None
-            
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                st.warning(f"🔄 Request failed on attempt {attempt + 1}: {e}. Retrying...")
-                continue
-            st.error(f"❌ Request failed after all retry attempts: {e}")
-            return None
-    
-    return None
 
-if uploaded_file is not None:
+    # Reuse the caller's client for batch dispatch, otherwise own one
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(timeout=timeout)
+
     try:
-        # Load and validate image
-        image = Image.open(uploaded_file).convert("RGB")
-        
-        # Validate image size
-        if image.width < 100 or image.height < 100:
-            st.error("❌ Image too small. Please upload a larger image.")
-            st.stop()
-        
-        if image.width * image.height > 50_000_000:  # ~50MP limit
-            st.warning("⚠️ Large image detected. Resizing for better performance...")
-            image.thumbnail((3000, 3000), Image.Resampling.LANCZOS)
-        
-        # Generate unique form ID
-        img_bytes = io.BytesIO()
-        image.save(img_bytes, format='JPEG', quality=95)
-        form_hash = hashlib.md5(img_bytes.getvalue()).hexdigest()
-        st.success(f"📄 Unique Form ID (MD5): {form_hash}")
-        
-        # Image preprocessing options
-        st.subheader("🔧 Preprocessing Options")
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            confidence_threshold = st.slider("OCR Confidence Threshold", 30, 90, 60)
-        with col2:
-            use_preprocessing = st.checkbox("Enhanced Preprocessing", value=True)
-        
-        # Preprocess image
-        if use_preprocessing:
-            processed_image = preprocess_image(image)
-        else:
-            processed_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
-            _, processed_image = cv2.threshold(processed_image, 150, 255, cv2.THRESH_BINARY_INV)
-        
-        # Extract OCR data
-        ocr_results = extract_ocr_data(processed_image, confidence_threshold)
-        
-        if not ocr_results:
-            st.warning("⚠️ No high-confidence text detected. Try adjusting the confidence threshold or using a clearer image.")
-        else:
-            # Display annotated image
-            annotated_img = create_annotated_image(np.array(image), ocr_results)
-            st.image(annotated_img, caption=f"Detected {len(ocr_results)} text regions", channels="RGB")
-            
-            # Show OCR results
-            with st.expander(f"🔍 OCR Results ({len(ocr_results)} items)", expanded=False):
-                st.json(ocr_results)
-            
-            # Form metadata
-            form_meta = {
-                "form_id": form_hash,
-                "image_width": image.width,
-                "image_height": image.height,
-                "num_ocr_entries": len(ocr_results),
-                "confidence_threshold": confidence_threshold,
-                "preprocessing_enabled": use_preprocessing
-            }
-            
-            # Generate and display prompt
-            prompt = generate_vision_llm_prompt(form_meta, ocr_results)
-            
-            with st.expander("🧠 Vision LLM Prompt", expanded=False):
-                st.code(prompt, language="text")
-            
-            # Call Vision LLM API
-            if st.button("🚀 Extract Form Schema"):
-                if not vision_llm_api_url.strip():
-                    st.error("❌ Please provide a valid API endpoint URL.")
+        # Retry handling (backoff + jitter, non-retryable codes exit
+        # immediately) lives in the tenacity decorator on _post_once
+        post = _post_once.retry_with(stop=stop_after_attempt(max_retries))
+        response = await post(client, api_url, files, data, headers)
+
+        # Validate response content type
+        content_type = response.headers.get('content-type', '')
+        if 'application/json' not in content_type:
+            st.warning(f"⚠️ Unexpected content type: {content_type}")
+
+        return response.json()
+
+    except httpx.TimeoutException:
+        st.error("❌ Request timed out after all retry attempts.")
+        return None
+
+    except httpx.ConnectError:
+        st.error("❌ Could not connect to Vision LLM API after all retry attempts. Check the endpoint URL.")
+        return None
+
+    except (RetryableAPIError, NonRetryableAPIError) as e:
+        st.error(f"❌ {e}")
+        return None
+
+    except httpx.HTTPStatusError as e:
+        st.error(f"❌ HTTP Error {e.response.status_code}: {e.response.text}")
+        return None
+
+    except json.JSONDecodeError:
+        st.error("❌ Invalid JSON response from API")
+        st.text("Response content:")
+        st.code(response.text[:500])  # Show first 500 chars of response
+        return None
+
+    except httpx.RequestError as e:
+        st.error(f"❌ Request failed after all retry attempts: {e}")
+        return None
+
+    finally:
+        if own_client:
+            await client.aclose()
+
+async def call_vision_llm_api_batch(
+    api_url: str,
+    image_prompt_pairs: List[tuple],
+    auth_token: str = None,
+    api_key: str = None,
+    timeout: int = 30,
+    max_retries: int = 3,
+    max_concurrency: int = 5
+) -> List[Dict[str, Any]]:
+    """Dispatch multiple (image_file, prompt, filename, mime_type) payloads
+    concurrently over one client
+
+    A semaphore caps in-flight requests so large batches don't trip the
+    API rate limit. Filename/mime travel per payload because the upload
+    encode can fall back to JPEG on a per-image basis.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def one(image_file: io.BytesIO, prompt: str, filename: str, mime_type: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await call_vision_llm_api(
+                api_url, image_file, prompt,
+                auth_token=auth_token, api_key=api_key,
+                timeout=timeout, max_retries=max_retries, client=client,
+                filename=filename, mime_type=mime_type
+            )
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        return await asyncio.gather(*[
+            one(image_file, prompt, filename, mime_type)
+            for image_file, prompt, filename, mime_type in image_prompt_pairs
+        ])
+
+if uploaded_files:
+    # Image preprocessing options (shared across the batch)
+    st.subheader("🔧 Preprocessing Options")
+
+    backend_options = ["Tesseract (CPU)"]
+    if PADDLEOCR_AVAILABLE:
+        backend_options.append("PaddleOCR (GPU)")
+    ocr_backend_label = st.radio("🧠 OCR Backend", backend_options, horizontal=True)
+    use_paddle = ocr_backend_label.startswith("PaddleOCR")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        confidence_threshold = st.slider("OCR Confidence Threshold", 30, 90, 60)
+    with col2:
+        use_preprocessing = st.checkbox("Enhanced Preprocessing", value=True, disabled=use_paddle)
+
+    # Fingerprint the raw upload bytes before any decode — same uniqueness
+    # as hashing a re-encode, at near-zero cost
+    file_hashes = [
+        hashlib.blake2b(f.getbuffer(), digest_size=16).hexdigest()
+        for f in uploaded_files
+    ]
+
+    # Evict session entries for forms no longer in the uploader so their
+    # annotated buffers and payloads don't accumulate over a long session
+    form_runs = st.session_state.setdefault("form_runs", {})
+    for stale_hash in set(form_runs) - set(file_hashes):
+        del form_runs[stale_hash]
+
+    # Run the OCR pipeline per file; collect the payloads for the batch API call
+    forms = []
+    # Disambiguate repeated filenames — uploading the same file twice is valid
+    tab_labels = []
+    seen_names = {}
+    for f in uploaded_files:
+        count = seen_names.get(f.name, 0)
+        seen_names[f.name] = count + 1
+        tab_labels.append(f"{f.name} ({count + 1})" if count else f.name)
+    tabs = st.tabs(tab_labels)
+
+    for uploaded_file, form_hash, tab in zip(uploaded_files, file_hashes, tabs):
+        with tab:
+            try:
+                # Session fast path: if nothing affecting this form changed
+                # since the last run, skip decode/OCR/annotation entirely —
+                # the rerun only replays the display calls below
+                run_key = (form_hash, confidence_threshold, use_preprocessing, use_paddle)
+                cached_run = form_runs.get(form_hash)
+
+                if cached_run and cached_run["run_key"] == run_key:
+                    img_bytes = cached_run["img_bytes"]
+                    upload_name = cached_run["upload_name"]
+                    upload_mime = cached_run["upload_mime"]
+                    ocr_results = cached_run["ocr_results"]
+                    annotated_img = cached_run["annotated_img"]
+                    prompt = cached_run["prompt"]
+                    st.success(f"📄 Unique Form ID (BLAKE2): {form_hash}")
                 else:
-                    img_bytes.seek(0)  # Reset buffer position
-                    response = call_vision_llm_api(
-                        vision_llm_api_url, 
-                        img_bytes.getvalue(), 
-                        prompt, 
-                        vision_llm_auth_token if vision_llm_auth_token.strip() else None,
-                        vision_llm_api_key if vision_llm_api_key.strip() else None,
-                        config['timeout'],
-                        config['max_retries']
-                    )
-                    
-                    if response:
-                        st.subheader("📦 Form Schema Extracted")
-                        st.json(response)
-                        
-                        # Option to download the schema
-                        schema_json = json.dumps(response, indent=2)
-                        st.download_button(
-                            label="💾 Download Form Schema",
-                            data=schema_json,
-                            file_name=f"form_schema_{form_hash[:8]}.json",
-                            mime="application/json"
+                    # Decode straight from the upload buffer: grayscale for OCR,
+                    # color for annotation/upload — no intermediate PIL/RGB copies
+                    file_buf = np.frombuffer(uploaded_file.getbuffer(), np.uint8)
+                    gray = cv2.imdecode(file_buf, cv2.IMREAD_GRAYSCALE)
+                    bgr = cv2.imdecode(file_buf, cv2.IMREAD_COLOR)
+
+                    if gray is None or bgr is None:
+                        st.error("❌ Could not decode image. Please upload a valid image file.")
+                        continue
+
+                    # Validate image size
+                    img_height, img_width = gray.shape
+                    if img_width < 100 or img_height < 100:
+                        st.error("❌ Image too small. Please upload a larger image.")
+                        continue
+
+                    if img_width > 1600 or img_height > 1600:
+                        # OCR is robust to moderate downsampling, and a smaller image
+                        # speeds up every stage downstream; keeping the resize here
+                        # means OCR boxes, annotation, and the prompt share coordinates
+                        scale = 1600 / max(img_width, img_height)
+                        new_size = (int(img_width * scale), int(img_height * scale))
+                        gray = cv2.resize(gray, new_size, interpolation=cv2.INTER_AREA)
+                        bgr = cv2.resize(bgr, new_size, interpolation=cv2.INTER_AREA)
+                        img_height, img_width = gray.shape
+
+                    # Encode the upload payload for the API call
+                    img_bytes, upload_name, upload_mime = encode_upload_image(bgr)
+                    st.success(f"📄 Unique Form ID (BLAKE2): {form_hash}")
+
+                    if use_paddle:
+                        # PaddleOCR runs its own detection/rectification, so skip the CPU
+                        # preprocessing pipeline and feed it the decoded image directly
+                        ocr_results = extract_ocr_data(
+                            form_hash, bgr, confidence_threshold, backend="paddleocr"
                         )
-    
-    except Exception as e:
-        st.error(f"❌ Error processing image: {e}")
-        st.exception(e)  # Show full traceback in development
+                    else:
+                        # Preprocess image and extract OCR data (both cached on form_hash,
+                        # so slider changes only recompute what actually depends on them)
+                        processed_image = preprocess_image(form_hash, gray, use_preprocessing)
+                        ocr_results = extract_ocr_data(
+                            form_hash, processed_image, confidence_threshold,
+                            use_preprocessing=use_preprocessing
+                        )
+
+                    if not ocr_results:
+                        st.warning("⚠️ No high-confidence text detected. Try adjusting the confidence threshold or using a clearer image.")
+                        continue
+
+                    annotated_img = create_annotated_image(form_hash, bgr, ocr_results)
+
+                    # Form metadata
+                    form_meta = {
+                        "form_id": form_hash,
+                        "image_width": img_width,
+                        "image_height": img_height,
+                        "num_ocr_entries": len(ocr_results),
+                        "confidence_threshold": confidence_threshold,
+                        "preprocessing_enabled": use_preprocessing,
+                        "ocr_backend": "paddleocr" if use_paddle else "tesseract"
+                    }
+
+                    prompt = generate_vision_llm_prompt(form_hash, form_meta, ocr_results)
+
+                    form_runs[form_hash] = {
+                        "run_key": run_key,
+                        "img_bytes": img_bytes,
+                        "upload_name": upload_name,
+                        "upload_mime": upload_mime,
+                        "ocr_results": ocr_results,
+                        "annotated_img": annotated_img,
+                        "prompt": prompt
+                    }
+
+                # Display annotated image
+                st.image(annotated_img, caption=f"Detected {len(ocr_results)} text regions", channels="BGR")
+
+                # Show OCR results
+                with st.expander(f"🔍 OCR Results ({len(ocr_results)} items)", expanded=False):
+                    st.json(ocr_results)
+
+                # Show the Vision LLM prompt
+                with st.expander("🧠 Vision LLM Prompt", expanded=False):
+                    st.code(prompt, language="text")
+
+                forms.append({
+                    "name": uploaded_file.name,
+                    "form_hash": form_hash,
+                    "img_bytes": img_bytes,
+                    "upload_name": upload_name,
+                    "upload_mime": upload_mime,
+                    "prompt": prompt
+                })
+
+            except Exception as e:
+                st.error(f"❌ Error processing image: {e}")
+                st.exception(e)  # Show full traceback in development
+
+    # Call Vision LLM API for every successfully processed form
+    if forms and st.button(f"🚀 Extract Form Schema ({len(forms)} form{'s' if len(forms) > 1 else ''})"):
+        if not vision_llm_api_url.strip():
+            st.error("❌ Please provide a valid API endpoint URL.")
+        else:
+            with st.spinner(f"Calling Vision LLM API ({len(forms)} request(s), up to {max_concurrent_calls} concurrent)..."):
+                responses = asyncio.run(call_vision_llm_api_batch(
+                    vision_llm_api_url,
+                    [
+                        (form["img_bytes"], form["prompt"], form["upload_name"], form["upload_mime"])
+                        for form in forms
+                    ],
+                    vision_llm_auth_token if vision_llm_auth_token.strip() else None,
+                    vision_llm_api_key if vision_llm_api_key.strip() else None,
+                    config['timeout'],
+                    config['max_retries'],
+                    max_concurrency=max_concurrent_calls
+                ))
+
+            for i, (form, response) in enumerate(zip(forms, responses)):
+                if response:
+                    st.subheader(f"📦 Form Schema Extracted — {form['name']}")
+                    st.json(response)
+
+                    # Option to download the schema
+                    schema_json = orjson.dumps(response, option=orjson.OPT_INDENT_2).decode()
+                    st.download_button(
+                        label="💾 Download Form Schema",
+                        data=schema_json,
+                        file_name=f"form_schema_{form['form_hash'][:8]}.json",
+                        mime="application/json",
+                        # Keyed by batch position too: duplicate uploads share a hash
+                        key=f"download_{i}_{form['form_hash'][:8]}"
+                    )
 
 # --- Sidebar with help information ---
 with st.sidebar:
@@ -394,6 +783,9 @@ with st.sidebar:
     VISION_LLM_API_KEY=your_api_key
     API_TIMEOUT=30
     API_MAX_RETRIES=3
+    MAX_CONCURRENT_LLM_CALLS=5
+    UPLOAD_FORMAT=webp
+    PADDLE_USE_GPU=true
     ```
     
     **API Requirements:**
@@ -417,7 +809,10 @@ with st.sidebar:
         "VISION_LLM_AUTH_TOKEN": bool(os.getenv("VISION_LLM_AUTH_TOKEN")),
         "VISION_LLM_API_KEY": bool(os.getenv("VISION_LLM_API_KEY")),
         "API_TIMEOUT": bool(os.getenv("API_TIMEOUT")),
-        "API_MAX_RETRIES": bool(os.getenv("API_MAX_RETRIES"))
+        "API_MAX_RETRIES": bool(os.getenv("API_MAX_RETRIES")),
+        "MAX_CONCURRENT_LLM_CALLS": bool(os.getenv("MAX_CONCURRENT_LLM_CALLS")),
+        "UPLOAD_FORMAT": bool(os.getenv("UPLOAD_FORMAT")),
+        "PADDLE_USE_GPU": bool(os.getenv("PADDLE_USE_GPU"))
     }
     
     for var, is_set in env_vars.items():
@@ -425,5 +820,6 @@ with st.sidebar:
         st.text(f"{status} {var}")
         
     if st.button("🔄 Reload Environment"):
-        st.cache_data.clear()
+        load_dotenv(override=True)
+        config.update(load_api_config())
         st.rerun()